@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 import os
 import sys
-import requests
+import asyncio
+import httpx
+import aiofiles
 import logging
+import logging.handlers
+import atexit
+import queue
+import contextlib
+import hashlib
+import mmap
 import time
-import random
-import base64
+import json
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import re
 from dotenv import load_dotenv
@@ -14,27 +24,69 @@ from urllib.parse import urlparse
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
+# Configure logging; the log file is written by a background thread so downloads never wait on it
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, logging.FileHandler("download_log.txt"))
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("download_log.txt"),
+        logging.handlers.QueueHandler(log_queue),
         logging.StreamHandler(sys.stdout)
     ]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
+# httpx logs every request at INFO level; keep the log focused on downloads
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
 # Create output directory
 OUTPUT_DIR = "github_download"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Trees and downloaded file hashes are remembered here between runs
+CACHE_DIR = os.path.join(OUTPUT_DIR, ".cache")
+
+# Branch names can move, so their cached tree is only trusted for this many seconds
+BRANCH_TREE_TTL = 5 * 60
+
+# Maximum number of files downloaded at the same time
+MAX_CONCURRENCY = 16
+
+# Maximum number of pooled connections; HTTP/2 multiplexes many requests over each one
+CONNECTION_POOL_SIZE = 8
+
+# Retry transient failures with exponential backoff (0.5s, 1s, 2s)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Log download progress once per this many files rather than once per file
+PROGRESS_INTERVAL = 100
+
+# Size of the pieces file bodies are streamed to disk in
+CHUNK_SIZE = 64 * 1024
+
+# Local files at least this large are memory-mapped instead of read into memory when hashed
+MMAP_THRESHOLD = 1024 * 1024
+
+# Pattern for GitHub URLs (https://github.com/owner/repo/tree/commit/path), ignoring a trailing slash
+GITHUB_URL_PATTERN = re.compile(r'https://github\.com/([^/]+)/([^/]+)/(?:tree|blob)/([^/]+)(?:/(.*?))?/?')
+
+# Pause all requests until the rate limit resets once fewer calls than this remain
+RATE_LIMIT_THRESHOLD = 50
+
+# Download a single tarball instead of individual files when more than this many are needed...
+TARBALL_THRESHOLD = 50
+# ...and they make up at least this share of the repository's bytes, since the tarball holds all of them
+TARBALL_MIN_SHARE = 0.5
+
 
 def parse_github_url(url):
     """Parse a GitHub URL to extract owner, repo, commit, and path."""
-    # Pattern for GitHub URLs (https://github.com/owner/repo/tree/commit/path)
-    pattern = r'https://github\.com/([^/]+)/([^/]+)/(?:tree|blob)/([^/]+)(?:/(.*))?'
-    match = re.match(pattern, url)
+    match = GITHUB_URL_PATTERN.fullmatch(url.strip())
 
     if not match:
         raise ValueError("Invalid GitHub URL format. Expected: https://github.com/owner/repo/tree/commit/path")
@@ -47,202 +99,631 @@ def parse_github_url(url):
     return owner, repo, commit, path
 
 
-def list_directory_contents(username, repo, path, commit_hash, auth):
+class RateLimiter:
+    """Hold back every request while GitHub reports the rate limit as exhausted.
+
+    Create it inside the running event loop: before Python 3.10 an asyncio.Event is bound
+    to the loop that was current when it was created.
+    """
+
+    def __init__(self, threshold=RATE_LIMIT_THRESHOLD):
+        self.threshold = threshold
+        self._open = asyncio.Event()
+        self._open.set()
+        self._resume_at = 0.0
+        self._timer = None
+
+    async def wait(self):
+        """Wait until requests are allowed again."""
+        await self._open.wait()
+
+    def pause(self, seconds):
+        """Block new requests for the given number of seconds."""
+        resume_at = time.monotonic() + seconds
+        if resume_at <= self._resume_at:
+            return
+
+        logger.warning(f"GitHub rate limit reached, pausing requests for {seconds:.1f}s")
+        self._resume_at = resume_at
+        self._open.clear()
+        if self._timer:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(seconds, self._open.set)
+
+    def update(self, response):
+        """Throttle based on a response's rate limit headers; return True if it should be retried."""
+        headers = response.headers
+
+        if response.status_code in (403, 429) and 'Retry-After' in headers:
+            # Secondary rate limit: GitHub says exactly how long to back off
+            self.pause(float(headers['Retry-After']))
+            return True
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return False
+
+        if int(remaining) < self.threshold:
+            # Primary rate limit: wait for the bucket to refill (plus a second for clock skew)
+            self.pause(max(float(reset) - time.time(), 0) + 1)
+            return response.status_code in (403, 429) and int(remaining) == 0
+
+        return False
+
+
+@contextlib.asynccontextmanager
+async def fetch(session, rate_limiter, url, **kwargs):
+    """GET a URL through the shared session, honouring rate limits and retrying transient failures."""
+    for attempt in range(MAX_RETRIES + 1):
+        delay = BACKOFF_FACTOR * (2 ** attempt)
+        await rate_limiter.wait()
+        request = session.build_request('GET', url, **kwargs)
+        try:
+            response = await session.send(request, stream=True)
+        except httpx.TransportError:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(delay)
+            continue
+
+        if rate_limiter.update(response) and attempt < MAX_RETRIES:
+            # Rate limited: retry once the limiter lets requests through again
+            await response.aclose()
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            logger.warning(f"Got status {response.status_code} for {url}, retrying in {delay}s")
+            await response.aclose()
+            await asyncio.sleep(delay)
+            continue
+
+        try:
+            yield response
+        finally:
+            await response.aclose()
+        return
+
+
+async def list_directory_contents(session, rate_limiter, username, repo, path, commit_hash):
     """List the contents of a directory in the GitHub repository using the API."""
     # GitHub API URL for getting directory contents at a specific commit
     api_url = f"https://api.github.com/repos/{username}/{repo}/contents/{path}?ref={commit_hash}"
 
-    try:
-        response = requests.get(api_url, auth=auth, timeout=15)
+    # Ask for raw file bodies rather than base64-wrapped JSON; directories are still listed as JSON
+    headers = {"Accept": "application/vnd.github.raw+json"}
 
-        if response.status_code == 200:
-            contents = response.json()
-            return contents, True
-        else:
-            logger.warning(f"Failed to list contents at {path}. Status code: {response.status_code}")
-            logger.warning(f"Response: {response.text}")
-            return [], False
+    try:
+        async with fetch(session, rate_limiter, api_url, headers=headers) as response:
+            await response.aread()
+            if response.status_code == 200:
+                contents = response.json()
+                return contents, True
+            else:
+                logger.warning(f"Failed to list contents at {path}. Status code: {response.status_code}")
+                logger.warning(f"Response: {response.text}")
+                return [], False
 
     except Exception as e:
         logger.error(f"Error listing contents at {path}: {str(e)}")
         return [], False
 
 
-def download_file(username, repo, file_path, file_name, output_dir, commit_hash, auth):
-    """Download a file from GitHub using the API."""
-    # GitHub API URL for getting file contents at a specific commit
-    api_url = f"https://api.github.com/repos/{username}/{repo}/contents/{file_path}?ref={commit_hash}"
+def is_commit_sha(ref):
+    """Return True if ref looks like a (possibly abbreviated) commit hash rather than a branch or tag."""
+    return re.fullmatch(r'[0-9a-f]{7,40}', ref) is not None
+
+
+def get_cache_path(username, repo, commit_hash):
+    """Return the path of the cache file for a repository at a commit."""
+    return os.path.join(CACHE_DIR, f"{username}_{repo}_{commit_hash}.json")
+
+
+def load_cache(username, repo, commit_hash):
+    """Load the cached tree and downloaded file hashes, or an empty cache if there are none."""
+    cache_path = get_cache_path(username, repo, commit_hash)
+
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable cache {cache_path}: {str(e)}")
+        cache = {}
+
+    cache.setdefault('files', {})
+    return cache
+
+
+def save_cache(cache, username, repo, commit_hash):
+    """Write the cache to disk, replacing the previous version atomically."""
+    cache_path = get_cache_path(username, repo, commit_hash)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    try:
+        with open(f"{cache_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(f"{cache_path}.tmp", cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write cache {cache_path}: {str(e)}")
+
+
+async def fetch_tree(session, rate_limiter, username, repo, commit_hash, cache):
+    """Fetch the whole repository tree at a commit with a single API call, reusing the cache when possible."""
+    # GitHub API URL for getting the recursive tree at a specific commit
+    api_url = f"https://api.github.com/repos/{username}/{repo}/git/trees/{commit_hash}?recursive=1"
+
+    if 'tree' in cache:
+        # A commit's tree never changes; a branch's is trusted for a short while
+        age = time.time() - cache.get('fetched_at', 0)
+        if is_commit_sha(commit_hash) or age < BRANCH_TREE_TTL:
+            logger.info(f"Using cached tree for {commit_hash}")
+            return cache['tree'], True
+
+    # Revalidate the cached tree, if any, instead of downloading it again
+    headers = {'If-None-Match': cache['etag']} if 'tree' in cache and cache.get('etag') else {}
+
+    try:
+        async with fetch(session, rate_limiter, api_url, headers=headers) as response:
+            await response.aread()
+            if response.status_code == 304:
+                logger.info(f"Cached tree for {commit_hash} is still current")
+                cache['fetched_at'] = time.time()
+                return cache['tree'], True
+            elif response.status_code == 200:
+                tree = response.json()
+                cache['tree'] = tree
+                cache['etag'] = response.headers.get('ETag')
+                cache['fetched_at'] = time.time()
+                return tree, True
+            else:
+                logger.warning(f"Failed to fetch tree at {commit_hash}. Status code: {response.status_code}")
+                logger.warning(f"Response: {response.text}")
+                return {}, False
+
+    except Exception as e:
+        logger.error(f"Error fetching tree at {commit_hash}: {str(e)}")
+        return {}, False
+
+
+async def save_response(response, output_path):
+    """Stream a response body to output_path without blocking the event loop on disk writes."""
+    # Write byte for byte, whether the file is text or binary
+    try:
+        async with aiofiles.open(output_path, 'wb') as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                await f.write(chunk)
+    except BaseException:
+        # Don't leave a truncated file behind
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+async def download_file(session, rate_limiter, sem, username, repo, file_path, output_path, commit_hash):
+    """Download a file from GitHub using its raw URL, falling back to the contents API."""
+    # Raw URL serves the file bytes directly, without a JSON/base64 envelope
     raw_url = f"https://raw.githubusercontent.com/{username}/{repo}/{commit_hash}/{file_path}"
+    # The contents API serves the same raw bytes when asked for the raw media type
+    api_url = f"https://api.github.com/repos/{username}/{repo}/contents/{file_path}?ref={commit_hash}"
+
+    # Bound the number of downloads in flight
+    async with sem:
+        logger.debug(f"Trying to download: {file_path}")
+
+        try:
+            async with fetch(session, rate_limiter, raw_url) as response:
+                if response.status_code == 200:
+                    await save_response(response, output_path)
 
-    logger.info(f"Trying to download: {file_path}")
+                    logger.debug(f"Successfully downloaded {file_path}")
+                    return True
 
+                raw_status = response.status_code
+
+            # If the raw URL fails (e.g. for some private repositories), try the contents API
+            logger.debug(f"Raw URL failed, trying the contents API: {api_url}")
+            raw_headers = {"Accept": "application/vnd.github.raw"}
+            async with fetch(session, rate_limiter, api_url, headers=raw_headers) as response:
+                if response.status_code == 200:
+                    await save_response(response, output_path)
+
+                    logger.debug(f"Successfully downloaded {file_path} using the contents API")
+                    return True
+
+                logger.warning(
+                    f"Failed to download {file_path}. Status codes: Raw={raw_status}, API={response.status_code}")
+                return False
+
+        except Exception as e:
+            logger.error(f"Error downloading {file_path}: {str(e)}")
+            return False
+
+
+def log_progress(downloads):
+    """Log a progress line every PROGRESS_INTERVAL finished download tasks, and after the last one."""
+    total = len(downloads)
+    finished = 0
+
+    def on_done(_):
+        nonlocal finished
+        finished += 1
+        if finished % PROGRESS_INTERVAL == 0 or finished == total:
+            logger.info(f"Processed {finished}/{total} files")
+
+    for download in downloads:
+        download.add_done_callback(on_done)
+
+
+def git_blob_sha(path):
+    """Compute the git object id of a local file: the sha1 of a "blob <size>" header, a NUL byte and its bytes."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(f"blob {size}\0".encode())
+
+    with open(path, 'rb') as f:
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def file_record(item, output_path):
+    """Return the cache record of output_path holding item's blob, or None if the file is missing."""
     try:
-        # First try with the GitHub API
-        api_response = requests.get(api_url, auth=auth, timeout=15)
-
-        if api_response.status_code == 200:
-            try:
-                content_data = api_response.json()
-
-                # Check if it's a file (not a directory)
-                if isinstance(content_data, dict) and 'type' in content_data and content_data['type'] == 'file':
-                    if 'content' in content_data and content_data.get('encoding') == 'base64':
-                        # Decode base64 content
-                        file_content = base64.b64decode(content_data['content'])
-
-                        # Determine if it's a binary or text file
-                        is_binary = False
-                        try:
-                            file_content.decode('utf-8')
-                        except UnicodeDecodeError:
-                            is_binary = True
-
-                        # Save the file
-                        output_path = os.path.join(output_dir, file_name)
-                        mode = 'wb' if is_binary else 'w'
-
-                        with open(output_path, mode, encoding='utf-8' if mode == 'w' else None) as f:
-                            if is_binary:
-                                f.write(file_content)
-                            else:
-                                f.write(file_content.decode('utf-8'))
-
-                        logger.info(f"Successfully downloaded {file_name}")
-                        return True
-                    else:
-                        logger.warning(f"Content not found in API response for {file_path}")
-                else:
-                    logger.warning(f"The path {file_path} is not a file")
-            except Exception as e:
-                logger.error(f"Error processing API response for {file_path}: {str(e)}")
-
-        # If API method fails, try the raw URL
-        logger.info(f"API method failed, trying raw URL: {raw_url}")
-        raw_response = requests.get(raw_url, auth=auth, timeout=15)
-
-        if raw_response.status_code == 200:
-            # Save the file
-            output_path = os.path.join(output_dir, file_name)
-
-            # Try to determine if it's a binary file
-            is_binary = False
-            try:
-                raw_response.content.decode('utf-8')
-            except UnicodeDecodeError:
-                is_binary = True
-
-            mode = 'wb' if is_binary else 'w'
-
-            with open(output_path, mode, encoding='utf-8' if mode == 'w' else None) as f:
-                if is_binary:
-                    f.write(raw_response.content)
-                else:
-                    f.write(raw_response.text)
+        stat = os.stat(output_path)
+    except OSError:
+        return None
+
+    return {'sha': item['sha'], 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
 
-            logger.info(f"Successfully downloaded {file_name} using raw URL")
+
+def remember_file(cache, item, output_path):
+    """Record that output_path holds item's blob, so the next run can skip it without hashing."""
+    record = file_record(item, output_path)
+    if record is not None:
+        cache['files'][item['path']] = record
+
+
+async def is_up_to_date(item, output_path, cache):
+    """Return True if output_path already holds this exact blob, without any network request."""
+    try:
+        if os.path.getsize(output_path) != item.get('size'):
+            return False
+
+        # Trust a previous run's record only while the file's size and mtime are unchanged since
+        if cache['files'].get(item['path']) == file_record(item, output_path):
             return True
 
-        logger.warning(
-            f"Failed to download {file_path}. Status codes: API={api_response.status_code}, Raw={raw_response.status_code}")
+        # Hash in the bounded executor so large files don't stall the event loop
+        return await asyncio.to_thread(git_blob_sha, output_path) == item['sha']
+    except OSError:
         return False
 
-    except Exception as e:
-        logger.error(f"Error downloading {file_path}: {str(e)}")
-        return False
 
+async def process_directory(session, rate_limiter, sem, username, repo, path, output_base_dir, commit_hash,
+                            cache):
+    """Walk a directory breadth-first, listing each level concurrently and downloading files as they are found.
+
+    Returns the number of files downloaded and the number skipped because they were already up to date.
+    """
+    level = [path]
+    downloads = []
+    download_items = []
+    files_skipped = 0
+
+    # Bound the listings in flight as well, so a wide level doesn't trip GitHub's secondary rate limit;
+    # they get their own semaphore so they aren't queued behind downloads
+    listing_sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def list_directory(directory):
+        async with listing_sem:
+            return await list_directory_contents(session, rate_limiter, username, repo, directory, commit_hash)
+
+    while level:
+        # The directories on this level are listed concurrently, MAX_CONCURRENCY at a time
+        listings = await asyncio.gather(*[list_directory(directory) for directory in level])
+
+        next_level = []
+
+        for directory, (contents, success) in zip(level, listings):
+            if not success:
+                continue
+
+            # Every file listed here shares the same output directory
+            output_dir = os.path.normpath(f"{output_base_dir}/{directory}")
+            files = []
+
+            for item in contents:
+                # Skip .git directories and other hidden files
+                if item['name'].startswith('.'):
+                    continue
+
+                if item['type'] == 'file':
+                    files.append((item, os.path.join(output_dir, item['name'])))
+
+                elif item['type'] == 'dir':
+                    # List the subdirectory with the rest of the next level
+                    next_level.append(item['path'])
+
+            # Listings carry the blob sha and size as well, so check the local copies without a request
+            checks = await asyncio.gather(*[is_up_to_date(item, output_path, cache)
+                                            for item, output_path in files if 'sha' in item])
+            up_to_date = iter(checks)
+            output_dir_created = False
+
+            for item, output_path in files:
+                if 'sha' in item and next(up_to_date):
+                    remember_file(cache, item, output_path)
+                    files_skipped += 1
+                    continue
 
-def process_directory(username, repo, path, output_base_dir, commit_hash, auth):
-    """Recursively process a directory and its contents."""
-    contents, success = list_directory_contents(username, repo, path, commit_hash, auth)
+                # Create output directory once, before its first file
+                if not output_dir_created:
+                    os.makedirs(output_dir, exist_ok=True)
+                    output_dir_created = True
 
-    if not success:
-        return 0
+                # Start the download while the next level is being listed
+                downloads.append(asyncio.create_task(download_file(
+                    session, rate_limiter, sem, username, repo, item['path'], output_path, commit_hash)))
+                download_items.append((item, output_path))
 
-    files_downloaded = 0
+        level = next_level
+
+    log_progress(downloads)
+    results = await asyncio.gather(*downloads)
+
+    # Remember what was downloaded so the next run can skip it
+    for (item, output_path), result in zip(download_items, results):
+        if result and 'sha' in item:
+            remember_file(cache, item, output_path)
+
+    return sum(results), files_skipped
+
+
+def select_blobs(tree, folder_path):
+    """Return the file entries of a tree that live under folder_path, skipping hidden ones."""
+    folder_path = folder_path.strip('/')
+    prefix = f"{folder_path}/" if folder_path else ""
+
+    blobs = []
+    for item in tree.get('tree', []):
+        if item['type'] != 'blob':
+            continue
+
+        # Match the folder itself (a single file URL) or anything below it
+        if item['path'] == folder_path:
+            relative_path = os.path.basename(item['path'])
+        elif item['path'].startswith(prefix):
+            relative_path = item['path'][len(prefix):]
+        else:
+            continue
 
-    for item in contents:
         # Skip .git directories and other hidden files
-        if item['name'].startswith('.'):
+        if any(part.startswith('.') for part in relative_path.split('/')):
             continue
 
-        if item['type'] == 'file':
-            # Create output directory if it doesn't exist
-            relative_path = path
-            output_dir = os.path.join(output_base_dir, relative_path)
-            os.makedirs(output_dir, exist_ok=True)
+        blobs.append(item)
 
-            # Download the file
-            if download_file(username, repo, item['path'], item['name'], output_dir, commit_hash, auth):
-                files_downloaded += 1
+    return blobs
 
-                # Add a small delay to avoid rate limiting
-                time.sleep(random.uniform(0.1, 0.5))
 
-        elif item['type'] == 'dir':
-            # Recursively process subdirectory
-            sub_files = process_directory(username, repo, item['path'], output_base_dir, commit_hash, auth)
-            files_downloaded += sub_files
+def extract_tarball(archive, wanted):
+    """Extract the wanted files from a repository tarball.
 
-    return files_downloaded
+    wanted maps repository paths to (output path, blob sha) pairs. Only those paths are ever
+    written, so member names in the archive cannot place files anywhere else. Returns the set
+    of repository paths whose extracted bytes match their blob sha; the others (e.g. files
+    rewritten by an export-subst attribute) must be downloaded individually.
+    """
+    extracted = set()
 
+    with tarfile.open(fileobj=archive, mode='r|gz') as tar:
+        for member in tar:
+            # Every member sits under a top-level "{owner}-{repo}-{sha}/" directory
+            _, _, path = member.name.partition('/')
+            if path not in wanted:
+                continue
+            output_path, blob_sha = wanted[path]
 
-def main():
-    # Get GitHub credentials from .env file
-    github_username = os.getenv("GITHUB_USERNAME")
-    github_token = os.getenv("GITHUB_TOKEN")
+            if member.issym():
+                # Git stores a symlink as a blob holding its target, which is what the raw URL serves too
+                content = member.linkname.encode('utf-8')
+                digest = hashlib.sha1(f"blob {len(content)}\0".encode() + content)
+                with open(output_path, 'wb') as dst:
+                    dst.write(content)
+            elif member.isfile():
+                # Hash the bytes as they are written, the same way git hashes a blob
+                digest = hashlib.sha1(f"blob {member.size}\0".encode())
+                with tar.extractfile(member) as src, open(output_path, 'wb') as dst:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        dst.write(chunk)
+            else:
+                continue
+
+            if digest.hexdigest() == blob_sha:
+                extracted.add(path)
+            else:
+                logger.info(f"{path} differs from its blob in the tarball, it will be downloaded separately")
+
+    return extracted
 
-    if not github_username or not github_token:
-        logger.error("GitHub credentials not found in .env file.")
-        logger.error("Please create a .env file with GITHUB_USERNAME and GITHUB_TOKEN variables.")
-        print("\nExample .env file content:")
-        print("GITHUB_USERNAME=your_username")
-        print("GITHUB_TOKEN=your_personal_access_token")
-        sys.exit(1)
 
-    # Set authentication
-    auth = (github_username, github_token)
+async def download_tarball(session, rate_limiter, username, repo, commit_hash, wanted):
+    """Download the repository as one tarball and extract the wanted files from it.
+
+    Returns the set of repository paths that were extracted.
+    """
+    # GitHub API URL redirecting to the gzipped tarball of a specific commit
+    api_url = f"https://api.github.com/repos/{username}/{repo}/tarball/{commit_hash}"
+
+    logger.info(f"Downloading {len(wanted)} files as a single tarball")
 
-    # Test authentication
-    logger.info("Testing GitHub authentication...")
-    test_url = "https://api.github.com/user"
     try:
-        response = requests.get(test_url, auth=auth)
-        if response.status_code == 200:
-            user_data = response.json()
-            logger.info(f"Authentication successful! Logged in as: {user_data.get('login')}")
-        else:
-            logger.error(f"Authentication failed with status code: {response.status_code}")
-            logger.error("Please check your credentials in the .env file and try again.")
-            sys.exit(1)
+        with tempfile.TemporaryFile() as archive:
+            async with fetch(session, rate_limiter, api_url) as response:
+                if response.status_code != 200:
+                    logger.warning(f"Failed to download tarball. Status code: {response.status_code}")
+                    return set()
+
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    archive.write(chunk)
+
+            # tarfile reads synchronously, so extract off the event loop
+            archive.seek(0)
+            extracted = await asyncio.to_thread(extract_tarball, archive, wanted)
+
+        logger.info(f"Extracted {len(extracted)} files from tarball")
+        return extracted
+
     except Exception as e:
-        logger.error(f"Error testing authentication: {str(e)}")
-        sys.exit(1)
+        logger.error(f"Error downloading tarball: {str(e)}")
+        return set()
+
+
+async def download_folder(session, rate_limiter, sem, username, repo, folder_path, output_base_dir,
+                          commit_hash):
+    """Download every file under folder_path using a single recursive tree listing.
+
+    Returns the number of files downloaded and the number skipped because they were already up to date.
+    """
+    cache = load_cache(username, repo, commit_hash)
+    tree, success = await fetch_tree(session, rate_limiter, username, repo, commit_hash, cache)
+
+    if not success or tree.get('truncated'):
+        # The tree is unavailable or too large to be returned in one response,
+        # so walk the requested folder one directory at a time instead
+        if success:
+            logger.warning(f"Tree for {commit_hash} is truncated, listing {folder_path or '/'} directory by directory")
+        files_downloaded, files_skipped = await process_directory(session, rate_limiter, sem, username, repo,
+                                                                  folder_path, output_base_dir, commit_hash,
+                                                                  cache)
+        save_cache(cache, username, repo, commit_hash)
+        return files_downloaded, files_skipped
+
+    pending = []
+    output_dirs = set()
+    files_skipped = 0
+
+    # Tree paths always use "/", so build each output path once and normalise it for this OS
+    blobs = [(item, os.path.normpath(f"{output_base_dir}/{item['path']}")) for item in select_blobs(tree, folder_path)]
+
+    # Check the local copies concurrently, hashing in the bounded executor rather than one file at a time
+    checks = await asyncio.gather(*[is_up_to_date(item, output_path, cache) for item, output_path in blobs])
+
+    for (item, output_path), up_to_date in zip(blobs, checks):
+        # Skip files a previous run already downloaded at this exact version
+        if up_to_date:
+            remember_file(cache, item, output_path)
+            files_skipped += 1
+            continue
 
-    # Get the GitHub URL from user input
-    github_url = input("Enter GitHub URL (e.g., https://github.com/owner/repo/tree/commit/path): ")
+        output_dirs.add(os.path.dirname(output_path))
+        pending.append((item, output_path))
+
+    # Create each output directory once, rather than once per file
+    for output_dir in output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+
+    downloaded = set()
+
+    # One tarball is far cheaper than many per-file requests for large folders and whole repositories,
+    # as long as most of the repository's bytes are actually needed
+    pending_size = sum(item.get('size', 0) for item, _ in pending)
+    tree_size = sum(entry.get('size', 0) for entry in tree['tree'] if entry['type'] == 'blob')
+    if (pending and (len(pending) > TARBALL_THRESHOLD or not folder_path)
+            and pending_size >= TARBALL_MIN_SHARE * tree_size):
+        wanted = {item['path']: (output_path, item['sha']) for item, output_path in pending}
+        downloaded = await download_tarball(session, rate_limiter, username, repo, commit_hash, wanted)
+
+    # Download whatever the tarball did not provide one file at a time
+    remaining = [(item, output_path) for item, output_path in pending if item['path'] not in downloaded]
+    tasks = [asyncio.create_task(download_file(session, rate_limiter, sem, username, repo, item['path'], output_path,
+                                               commit_hash))
+             for item, output_path in remaining]
+    log_progress(tasks)
+    results = await asyncio.gather(*tasks)
+    downloaded.update(item['path'] for (item, _), success in zip(remaining, results) if success)
+
+    # Remember what was downloaded so the next run can skip it
+    for item, output_path in pending:
+        if item['path'] in downloaded:
+            remember_file(cache, item, output_path)
+    save_cache(cache, username, repo, commit_hash)
+
+    return len(downloaded), files_skipped
+
+
+async def run(github_token):
+    """Authenticate, ask for the GitHub URL and download the folder it points to."""
+    # Blocking work (aiofiles writes, tarball extraction) runs in the loop's default executor;
+    # size it to match the downloads in flight rather than the CPU-count based default
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=MAX_CONCURRENCY))
+
+    # Shared by every request, created here so it belongs to the running event loop
+    rate_limiter = RateLimiter()
+
+    # Share one HTTP/2 session (and its connection pool) across every request, with the
+    # token header built once instead of Basic auth being encoded for every request
+    headers = {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"token {github_token}",
+    }
+    # Time out stalled connections and reads, not large files that take a while to stream,
+    # nor requests waiting their turn for a pooled connection
+    timeout = httpx.Timeout(15, pool=None)
+    limits = httpx.Limits(max_connections=CONNECTION_POOL_SIZE, max_keepalive_connections=CONNECTION_POOL_SIZE)
+
+    async with httpx.AsyncClient(http2=True, headers=headers, timeout=timeout, limits=limits,
+                                 follow_redirects=True) as session:
+        # Test authentication
+        logger.info("Testing GitHub authentication...")
+        test_url = "https://api.github.com/user"
+        try:
+            async with fetch(session, rate_limiter, test_url) as response:
+                await response.aread()
+                if response.status_code == 200:
+                    user_data = response.json()
+                    logger.info(f"Authentication successful! Logged in as: {user_data.get('login')}")
+                else:
+                    logger.error(f"Authentication failed with status code: {response.status_code}")
+                    logger.error("Please check your credentials in the .env file and try again.")
+                    sys.exit(1)
+        except Exception as e:
+            logger.error(f"Error testing authentication: {str(e)}")
+            sys.exit(1)
 
-    try:
-        # Parse the GitHub URL
-        repo_owner, repo_name, commit_hash, folder_path = parse_github_url(github_url)
-
-        logger.info(f"Repository Owner: {repo_owner}")
-        logger.info(f"Repository Name: {repo_name}")
-        logger.info(f"Commit Hash: {commit_hash}")
-        logger.info(f"Folder Path: {folder_path}")
-    except ValueError as e:
-        logger.error(str(e))
-        sys.exit(1)
+        # Get the GitHub URL from user input
+        github_url = input("Enter GitHub URL (e.g., https://github.com/owner/repo/tree/commit/path): ")
 
-    start_time = datetime.now()
-    logger.info(f"Download operation started at {start_time}")
+        try:
+            # Parse the GitHub URL
+            repo_owner, repo_name, commit_hash, folder_path = parse_github_url(github_url)
 
-    # Create a specific output directory for this download
-    download_dir = os.path.join(OUTPUT_DIR, f"{repo_name}_{commit_hash[:7]}")
-    os.makedirs(download_dir, exist_ok=True)
+            logger.info(f"Repository Owner: {repo_owner}")
+            logger.info(f"Repository Name: {repo_name}")
+            logger.info(f"Commit Hash: {commit_hash}")
+            logger.info(f"Folder Path: {folder_path}")
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+        start_time = datetime.now()
+        logger.info(f"Download operation started at {start_time}")
+
+        # Create a specific output directory for this download
+        download_dir = os.path.join(OUTPUT_DIR, f"{repo_name}_{commit_hash[:7]}")
+        os.makedirs(download_dir, exist_ok=True)
 
-    # Process the directory
-    logger.info(f"Downloading all files from {repo_owner}/{repo_name}/{folder_path} at commit {commit_hash}")
-    files_downloaded = process_directory(repo_owner, repo_name, folder_path, download_dir, commit_hash, auth)
+        # Process the directory
+        logger.info(f"Downloading all files from {repo_owner}/{repo_name}/{folder_path} at commit {commit_hash}")
+        sem = asyncio.Semaphore(MAX_CONCURRENCY)
+        files_downloaded, files_skipped = await download_folder(session, rate_limiter, sem, repo_owner, repo_name,
+                                                                folder_path, download_dir, commit_hash)
 
     end_time = datetime.now()
     duration = end_time - start_time
@@ -251,11 +732,28 @@ def main():
     logger.info(f"Operation completed at {end_time} (Duration: {duration})")
     logger.info("Summary:")
     logger.info(f"- Total files downloaded: {files_downloaded}")
+    logger.info(f"- Files already up to date: {files_skipped}")
 
     logger.info("All operations have been completed.")
     logger.info(f"The downloaded files are in the '{download_dir}' directory.")
 
 
+def main():
+    # Get GitHub credentials from .env file
+    github_username = os.getenv("GITHUB_USERNAME")
+    github_token = os.getenv("GITHUB_TOKEN")
+
+    if not github_username or not github_token:
+        logger.error("GitHub credentials not found in .env file.")
+        logger.error("Please create a .env file with GITHUB_USERNAME and GITHUB_TOKEN variables.")
+        print("\nExample .env file content:")
+        print("GITHUB_USERNAME=your_username")
+        print("GITHUB_TOKEN=your_personal_access_token")
+        sys.exit(1)
+
+    asyncio.run(run(github_token))
+
+
 if __name__ == "__main__":
     print("\nGitHub Folder Downloader")
     print("========================")